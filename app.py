@@ -1,9 +1,15 @@
 import streamlit as st
 import geopandas as gpd
-from shapely.geometry import Polygon, MultiPolygon
+import numpy as np
+import shapely
+import pyproj
 import plotly.express as px
-import json
 import os
+import pickle
+import tempfile
+
+# Read vector data through pyogrio (GDAL's Arrow stream) rather than Fiona
+gpd.options.io_engine = "pyogrio"
 
 def set_custom_style():
     """
@@ -27,32 +33,103 @@ def set_custom_style():
     )
 
 # ----------------------------
-# Function to Extract Largest Polygon
+# Function to Extract Largest Polygons
 # ----------------------------
-def get_largest_polygon(geometry):
+def get_largest_polygons(geometries):
     """
-    Extracts the largest Polygon from a MultiPolygon geometry.
-    If the geometry is already a Polygon, it is returned as is.
-    Returns None for unsupported geometry types.
+    Extracts the largest Polygon from each geometry in an array.
+    A Polygon is returned as is, since it is its own single part.
+    Returns None for geometries without any parts.
     """
-    if isinstance(geometry, MultiPolygon):
-        # Ensure there is at least one polygon in the MultiPolygon
-        if len(geometry.geoms) == 0:
-            return None
-        return max(geometry.geoms, key=lambda p: p.area)
-    elif isinstance(geometry, Polygon):
-        return geometry
-    else:
-        return None
+    geometries = np.asarray(geometries)
+    parts, index = shapely.get_parts(geometries, return_index=True)
+    areas = shapely.area(parts)
+
+    # Sort parts by owning row, then by descending area, so the first part of each row is its largest
+    order = np.lexsort((-areas, index))
+    rows, first = np.unique(index[order], return_index=True)
+
+    largest = np.full(len(geometries), None, dtype=object)
+    largest[rows] = parts[order[first]]
+    return largest
+
+# ----------------------------
+# Function to Reproject to WGS84
+# ----------------------------
+def reproject_to_wgs84(geo_df):
+    """
+    Reprojects a GeoDataFrame to WGS84 (EPSG:4326).
+    All vertices go through a single PROJ transform as one coordinate array,
+    instead of one transform per geometry. Data already in WGS84, or without
+    a CRS, is returned unchanged.
+    """
+    if geo_df.crs is None or geo_df.crs.to_epsg() == 4326:
+        return geo_df
+
+    geometries = np.asarray(geo_df.geometry.values).copy()
+    coords = shapely.get_coordinates(geometries)
+    transformer = pyproj.Transformer.from_crs(geo_df.crs, 'EPSG:4326', always_xy=True)
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    shapely.set_coordinates(geometries, np.column_stack([x, y]))
+
+    geo_df['geometry'] = gpd.GeoSeries(geometries, index=geo_df.index, crs='EPSG:4326')
+    return geo_df
+
+# ----------------------------
+# On-Disk Cache Helpers
+# ----------------------------
+def is_cache_fresh(cache_path, shapefile_path):
+    """
+    Checks whether a cache file exists and is newer than every component of
+    the shapefile (.shp, .dbf, .shx, .prj) and this script, so a change to
+    any of them invalidates the cache.
+    """
+    if not os.path.exists(cache_path):
+        return False
+    base_path = os.path.splitext(shapefile_path)[0]
+    source_paths = [base_path + ext for ext in ('.shp', '.dbf', '.shx', '.prj')] + [__file__]
+    newest_source_mtime = max(os.path.getmtime(path) for path in source_paths if os.path.exists(path))
+    return os.path.getmtime(cache_path) > newest_source_mtime
+
+def write_cache_atomically(cache_path, writer):
+    """
+    Writes a cache file by calling writer(path) on a temporary file in the
+    same directory and then moving it into place, so an interrupted or failed
+    write never leaves a partial cache behind. A failed write only costs the
+    speedup, so errors are swallowed.
+    """
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(cache_path) + '.', suffix='.tmp', dir=os.path.dirname(cache_path)
+        )
+        os.close(fd)
+        writer(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def dump_pickle(obj, path):
+    """
+    Pickles an object to the given path.
+    """
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 # ----------------------------
 # Load and Process Data
 # ----------------------------
-@st.cache_data
+@st.cache_resource
 def load_data(shapefile_path):
     """
     Loads and processes the shapefile.
 
+    The processed result is written next to the shapefile as GeoParquet and
+    read back from there on later cold starts. The returned GeoDataFrame is
+    cached with st.cache_resource and shared by reference across sessions,
+    so callers must treat it as read-only.
+
     Parameters:
     - shapefile_path (str): Path to the .shp file.
 
@@ -63,48 +140,102 @@ def load_data(shapefile_path):
         st.error(f"Shapefile not found at `{shapefile_path}`. Please ensure the file exists.")
         st.stop()
 
+    # Reuse the processed GeoParquet if it is up to date
+    cache_path = shapefile_path + '.processed.parquet'
+    if is_cache_fresh(cache_path, shapefile_path):
+        try:
+            return gpd.read_parquet(cache_path)
+        except (OSError, ValueError):
+            pass  # Unreadable cache; rebuild it from the shapefile below
+
     # Load the shapefile into a GeoDataFrame
     try:
-        geo_df = gpd.read_file(shapefile_path)
+        geo_df = gpd.read_file(
+            shapefile_path,
+            engine="pyogrio",
+            use_arrow=True,
+            columns=['STATEFP', 'GEOID', 'ALAND', 'AWATER'],  # Only the fields used below
+            where="CAST(STATEFP AS INTEGER) < 57",            # States and DC only; skip territories in GDAL
+        )
     except Exception as e:
         st.error(f"Error loading shapefile: {e}")
         st.stop()
 
-    geo_df['filter1'] = geo_df['STATEFP'].astype(int)
-    geo_df = geo_df[geo_df['filter1']<57]
-
-
     # Identify Alaska rows using the FIPS code '02'
     alaska_fips = '02'
     is_alaska = geo_df['STATEFP'] == alaska_fips
 
-    # Extract the largest polygon for Alaska geometries
-    geo_df.loc[is_alaska, 'geometry'] = geo_df.loc[is_alaska, 'geometry'].apply(get_largest_polygon)
+    # Extract the largest polygon for Alaska geometries; only MultiPolygons need any work
+    is_multipolygon = shapely.get_type_id(geo_df.geometry.values) == shapely.GeometryType.MULTIPOLYGON
+    alaska_rows = np.flatnonzero(is_alaska & is_multipolygon)
+    if len(alaska_rows) > 0:
+        geometry_col = geo_df.columns.get_loc('geometry')
+        geo_df.iloc[alaska_rows, geometry_col] = get_largest_polygons(geo_df.geometry.values[alaska_rows])
 
     # Remove any Alaska rows where geometry is None (if any)
-    geo_df = geo_df[~(is_alaska & geo_df['geometry'].isnull())].copy()
+    geo_df.drop(geo_df.index[is_alaska & geo_df.geometry.isna()], inplace=True)
 
     # Reset index for cleanliness
     geo_df.reset_index(drop=True, inplace=True)
 
     # Reproject to WGS84 (EPSG:4326)
-    #geo_df = geo_df.to_crs(epsg=4326)
-    st.write(f"**GeoDataFrame CRS after projection:** {geo_df.crs}")
+    geo_df = reproject_to_wgs84(geo_df)
+
+    # Simplify the district outlines; 0.01 degrees (~1 km) is well below screen resolution at USA scope
+    geo_df['geometry'] = geo_df.geometry.simplify(tolerance=0.01, preserve_topology=True)
 
     # Calculate the land ratio: ALAND / (ALAND + AWATER)
-    geo_df['land_ratio'] = geo_df['ALAND'] / (geo_df['ALAND'] + geo_df['AWATER'])
+    # Districts with zero total area are left at 0 instead of dividing by zero
+    aland = geo_df['ALAND'].to_numpy(dtype=np.float32)
+    awater = geo_df['AWATER'].to_numpy(dtype=np.float32)
+    total_area = aland + awater
+    land_ratio = np.zeros_like(aland)
+    np.divide(aland, total_area, out=land_ratio, where=total_area > 0)
+    geo_df['land_ratio'] = land_ratio
+
+    # Keep only the columns the figures use; float32 is ample precision for plotting,
+    # and GEOID is stored as a category since it is only ever matched against the GeoJSON ids
+    geo_df = geo_df[['GEOID', 'ALAND', 'AWATER', 'land_ratio', 'geometry']].astype(
+        {'GEOID': 'category', 'ALAND': 'float32', 'AWATER': 'float32'}
+    )
 
-    # Handle potential division by zero (if ALAND + AWATER is zero)
-    geo_df['land_ratio'] = geo_df['land_ratio'].fillna(0)
+    # Write the processed data for the next cold start
+    write_cache_atomically(cache_path, lambda path: geo_df.to_parquet(path, compression='zstd'))
 
     return geo_df
 
+# ----------------------------
+# Build GeoJSON for Plotly
+# ----------------------------
+def gdf_to_geojson_dict(geo_df):
+    """
+    Builds a GeoJSON FeatureCollection dict straight from the geometries,
+    without encoding the GeoDataFrame to a JSON string and parsing it back.
+    Only the properties used by the choropleth are included, and null
+    geometries are written as null like GeoDataFrame.to_json() does.
+    """
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'id': geoid,
+                'properties': {'GEOID': geoid, 'land_ratio': land_ratio},
+                'geometry': geometry.__geo_interface__ if geometry is not None else None,
+            }
+            for geoid, land_ratio, geometry in zip(
+                geo_df['GEOID'].tolist(), geo_df['land_ratio'].tolist(), geo_df.geometry
+            )
+        ],
+    }
+
 # ----------------------------
 # Create Choropleth Map
 # ----------------------------
-def create_choropleth_map(geo_df):
-    # Convert GeoDataFrame to GeoJSON
-    geojson = json.loads(geo_df.to_json())
+def create_choropleth_map(geo_df, geojson=None):
+    # Convert GeoDataFrame to GeoJSON unless a prebuilt one is given
+    if geojson is None:
+        geojson = gdf_to_geojson_dict(geo_df)
 
     # Define a custom color scale that emphasizes blue
     custom_color_scale = [
@@ -141,6 +272,44 @@ def create_choropleth_map(geo_df):
 
     return fig
 
+# ----------------------------
+# Cached Figures
+# ----------------------------
+@st.cache_resource
+def get_choropleth_map(shapefile_path):
+    """
+    Builds the choropleth map once per process and shares it across reruns
+    and sessions, since its inputs never change. The returned figure must
+    not be modified.
+
+    The GeoJSON is cached as a pickle next to the shapefile. Loading a pickle
+    can run arbitrary code, so the shapefile directory must not be writable
+    by untrusted users.
+
+    Parameters:
+    - shapefile_path (str): Path to the .shp file.
+
+    Returns:
+    - Figure: The Plotly choropleth map.
+    """
+    geo_df = load_data(shapefile_path)
+
+    # Reuse the GeoJSON pickled by an earlier run if it is up to date
+    geojson_cache_path = shapefile_path + '.geojson.pkl'
+    geojson = None
+    if is_cache_fresh(geojson_cache_path, shapefile_path):
+        try:
+            with open(geojson_cache_path, 'rb') as f:
+                geojson = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass  # Unreadable cache; rebuild it below
+
+    if geojson is None:
+        geojson = gdf_to_geojson_dict(geo_df)
+        write_cache_atomically(geojson_cache_path, lambda path: dump_pickle(geojson, path))
+
+    return create_choropleth_map(geo_df, geojson)
+
 
 # ----------------------------
 # Main Streamlit App
@@ -166,17 +335,16 @@ def main():
         st.error(f"The shapefile `{shapefile_name}` does not exist in `{shapefile_dir}`. Please add it along with its components.")
         st.stop()
 
-    # Load and process the data
+    # Load the data and build the choropleth map
     with st.spinner("Loading and processing data..."):
-        geo_df = load_data(shapefile_path)
+        fig = get_choropleth_map(shapefile_path)
 
-   
-
-    # Create the choropleth map
-    fig = create_choropleth_map(geo_df)
-
-    # Display the map
-    st.plotly_chart(fig, use_container_width=True)
+    # Display the map without the modebar and interactions the app does not use
+    st.plotly_chart(
+        fig,
+        use_container_width=True,
+        config={'displayModeBar': False, 'scrollZoom': False, 'responsive': False, 'doubleClick': False},
+    )
 
 if __name__ == "__main__":
     main()